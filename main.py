@@ -2,17 +2,20 @@
 Main code for the Telegram Gemini AI assistant bot.
 """
 
+import asyncio
 import os
 import sys
 import logging
 import threading
 import time
-import schedule
-from dotenv import load_dotenv
+from typing import NoReturn
 
 from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters
+from telegram.request import HTTPXRequest
 
 from modules.exceptions import TelegramFloodControlException
+from modules.gemini import gemini_refresh_cache
+from modules.helpers import flood_control_origins
 from modules.logger import configure_logging
 from modules.repos import pull_and_update
 from modules.telegram import handle_start, handle_message, handle_telegram_error
@@ -22,33 +25,61 @@ from modules import state
 
 def load_environment() -> None:
     """Environment secrets are loaded using the .env file or straight from the system"""
+    from dotenv import load_dotenv
 
     # Load variables from .env file (if any)
     load_dotenv()
 
+    # Take a single snapshot of the environment instead of querying it for every variable
+    env = dict(os.environ)
+
     # Get global configuration
     # Assign new values
-    state.TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_API_KEY")
-    state.TELEGRAM_BOT_NAME = os.getenv("TELEGRAM_BOT_NAME")
-    state.GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-    state.GOOGLE_API_MODEL = os.getenv("GOOGLE_API_MODEL")
-    state.GOOGLE_API_MAX_ATTEMPTS = os.getenv("GOOGLE_API_MAX_ATTEMPTS", "2")
-    state.BUILD_DATE = os.getenv("BUILD_DATE", "Unknown")
-    state.REPO_URL = os.getenv("REPO_URL", "")
-    state.TELEGRAM_RESTART_DELAY_SECONDS = os.getenv("TELEGRAM_RESTART_DELAY_SECONDS", "15")
-    
+    state.TELEGRAM_BOT_TOKEN = env.get("TELEGRAM_API_KEY")
+    state.TELEGRAM_BOT_NAME = env.get("TELEGRAM_BOT_NAME")
+    state.GOOGLE_API_KEY = env.get("GOOGLE_API_KEY")
+    state.GOOGLE_API_MODEL = env.get("GOOGLE_API_MODEL")
+    state.BUILD_DATE = env.get("BUILD_DATE", "Unknown")
+    state.REPO_URL = env.get("REPO_URL", "")
+    state.GEMINI_WARMUP_FILE = env.get("GEMINI_WARMUP_FILE", "")
+    restart_delay = env.get("TELEGRAM_RESTART_DELAY_SECONDS", "15")
+
     try:
-        delay_seconds = int(state.TELEGRAM_RESTART_DELAY_SECONDS)
+        delay_seconds = int(restart_delay)
         if delay_seconds < 0:
             logging.warning("Restart delay is negative (%s), forcing to 0", delay_seconds)
             delay_seconds = 0
         if delay_seconds > 600:
             logging.warning("Restart delay too large (%s), capping to 600", delay_seconds)
             delay_seconds = 600
-        state.TELEGRAM_RESTART_DELAY_SECONDS = str(delay_seconds)
+        state.TELEGRAM_RESTART_DELAY_SECONDS = delay_seconds
+    except (TypeError, ValueError):
+        logging.warning("Invalid TELEGRAM_RESTART_DELAY_SECONDS [%s], using default 15", restart_delay)
+        state.TELEGRAM_RESTART_DELAY_SECONDS = 15
+
+    max_attempts = env.get("GOOGLE_API_MAX_ATTEMPTS", "2")
+
+    try:
+        attempts = int(max_attempts)
+        if attempts < 1:
+            logging.warning("Maximum Gemini API attempts is lower than 1 (%s), using default 2", attempts)
+            attempts = 2
+        state.GOOGLE_API_MAX_ATTEMPTS = attempts
+    except (TypeError, ValueError):
+        logging.warning("Invalid GOOGLE_API_MAX_ATTEMPTS [%s], using default 2", max_attempts)
+        state.GOOGLE_API_MAX_ATTEMPTS = 2
+
+    upload_concurrency = env.get("GEMINI_UPLOAD_CONCURRENCY", "8")
+
+    try:
+        concurrency = int(upload_concurrency)
+        if concurrency < 1:
+            logging.warning("Upload concurrency is lower than 1 (%s), forcing to 1", concurrency)
+            concurrency = 1
+        state.GEMINI_UPLOAD_CONCURRENCY = concurrency
     except (TypeError, ValueError):
-        logging.warning("Invalid TELEGRAM_RESTART_DELAY_SECONDS [%s], using default 15", state.TELEGRAM_RESTART_DELAY_SECONDS)
-        state.TELEGRAM_RESTART_DELAY_SECONDS = "15"
+        logging.warning("Invalid GEMINI_UPLOAD_CONCURRENCY [%s], using default 8", upload_concurrency)
+        state.GEMINI_UPLOAD_CONCURRENCY = 8
 
     # Check for configuration
     if not state.TELEGRAM_BOT_TOKEN:
@@ -83,26 +114,59 @@ def load_environment() -> None:
 
     logging.info("Using Gemini API model: %s", state.GOOGLE_API_MODEL)
     logging.info("Maximum Gemini API attempts: %s", state.GOOGLE_API_MAX_ATTEMPTS)
+    logging.info("Parallel Gemini file uploads: %s", state.GEMINI_UPLOAD_CONCURRENCY)
+    if state.GEMINI_WARMUP_FILE:
+        logging.info("Response cache warmup questions file: %s", state.GEMINI_WARMUP_FILE)
 
     logging.info("Docker image build date: %s", state.BUILD_DATE)
     logging.info("Restart delay on flood control: %s seconds", state.TELEGRAM_RESTART_DELAY_SECONDS)
 
+    # Group messages must start with one of these, longest first so the whole mention is removed
+    bot_name = state.TELEGRAM_BOT_NAME.lower()
+    if bot_name.startswith("@"):
+        bot_name = bot_name[1:]
+    state.MENTION_PREFIXES = (f"@{bot_name}", bot_name) if bot_name else ()
+
+    # The instruction only depends on the bot name, build it once for every query
+    state.SYSTEM_INSTRUCTION = f"You are `{state.TELEGRAM_BOT_NAME}`, a chatbot that can only answer to users request based solely on the source documents. Reply to the following message using the same language, when returning LaTex formulas, try to translate them to simple text if possible."
+
 def run_scheduler():
     """Runs the scheduler in a separate thread"""
+    import schedule
+
     logging.info("Starting scheduler thread...")
     schedule.every().day.at("00:00").do(pull_and_update)
     logging.debug("Scheduled daily repository update at 00:00")
+    schedule.every(30).minutes.do(gemini_refresh_cache)
+    logging.debug("Scheduled context cache refresh every 30 minutes")
 
     while True:
         schedule.run_pending()
-        time.sleep(1)
+        # Sleep until the next job is due, waking up at least once a minute
+        idle_seconds = schedule.idle_seconds()
+        if idle_seconds is None:
+            idle_seconds = 60
+        time.sleep(min(max(idle_seconds, 1), 60))
+
+def _restart_due_to_flood() -> NoReturn:
+    """Exits with the code that triggers a container restart, run_polling already stopped the bot"""
+    logging.critical("Initiating container restart due to flood control...")
+
+    # Exit with specific code that can trigger container restart
+    if state.TELEGRAM_RESTART_DELAY_SECONDS > 0:
+        logging.critical("Delaying restart by %s seconds", state.TELEGRAM_RESTART_DELAY_SECONDS)
+        time.sleep(state.TELEGRAM_RESTART_DELAY_SECONDS)
+    logging.critical("Exiting with code 2 to trigger container restart")
+    sys.exit(2)
+
+async def _on_startup(_app) -> None:
+    """Stores the loop running the bot, so other threads can wake up the handlers"""
+    state.EVENT_LOOP = asyncio.get_running_loop()
 
 def main():
     """Main routine of the robot"""
     logging.info("Starting the AI assistant bot...")
 
-    app = None
-
     try:
         # Start scheduler in background thread
         scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
@@ -114,7 +178,18 @@ def main():
 
         # Initialize the Telegram bot
         logging.debug("Building the Telegram bot")
-        app = ApplicationBuilder().token(state.TELEGRAM_BOT_TOKEN).build()
+        # HTTP/2 multiplexes the outgoing calls over pooled connections instead of opening new ones
+        bot_request = HTTPXRequest(connection_pool_size=256, http_version="2", read_timeout=20, write_timeout=20, connect_timeout=10)
+        updates_request = HTTPXRequest(http_version="2", connect_timeout=10)
+        app = (
+            ApplicationBuilder()
+            .token(state.TELEGRAM_BOT_TOKEN)
+            .request(bot_request)
+            .get_updates_request(updates_request)
+            .concurrent_updates(True)
+            .post_init(_on_startup)
+            .build()
+        )
 
         # Register handlers
         logging.debug("Registering the /start command handler")
@@ -130,56 +205,16 @@ def main():
 
     except TelegramFloodControlException as flood_exception:
         logging.critical("Telegram flood control exception detected: %s", flood_exception)
-        logging.critical("Initiating container restart due to flood control...")
-        
-        # Clean shutdown
-        if app is not None:
-            try:
-                app.stop()
-                logging.info("Bot application stopped gracefully")
-            except Exception as stop_exception:
-                logging.error("Error stopping bot application: %s", stop_exception)
-        
-        # Exit with specific code that can trigger container restart
-        try:
-            delay_seconds = int(state.TELEGRAM_RESTART_DELAY_SECONDS)
-            if delay_seconds > 0:
-                logging.critical("Delaying restart by %s seconds", delay_seconds)
-                time.sleep(delay_seconds)
-        except (TypeError, ValueError):
-            logging.warning("Invalid TELEGRAM_RESTART_DELAY_SECONDS [%s], skipping delay", state.TELEGRAM_RESTART_DELAY_SECONDS)
-        logging.critical("Exiting with code 2 to trigger container restart")
-        sys.exit(2)
-        
+        _restart_due_to_flood()
+
     except Exception as e:
         # Check if the exception contains flood control messages
         error_message = str(e)
-        if "Flood control exceeded" in error_message and ("Network Retry Loop" in error_message or "Polling Updates" in error_message):
+        if flood_control_origins(error_message):
             logging.critical("Flood control detected in main exception: %s", error_message)
-            logging.critical("Initiating container restart due to flood control...")
-            
-            # Clean shutdown
-            if app is not None:
-                try:
-                    app.stop()
-                    logging.info("Bot application stopped gracefully")
-                except Exception as stop_exception:
-                    logging.error("Error stopping bot application: %s", stop_exception)
-            
-            # Exit with specific code that can trigger container restart
-            try:
-                delay_seconds = int(state.TELEGRAM_RESTART_DELAY_SECONDS)
-                if delay_seconds > 0:
-                    logging.critical("Delaying restart by %s seconds", delay_seconds)
-                    time.sleep(delay_seconds)
-            except (TypeError, ValueError):
-                logging.warning("Invalid TELEGRAM_RESTART_DELAY_SECONDS [%s], skipping delay", state.TELEGRAM_RESTART_DELAY_SECONDS)
-            logging.critical("Exiting with code 2 to trigger container restart")
-            sys.exit(2)
-            
+            _restart_due_to_flood()
+
         logging.critical("Bot encountered an error: %s", e)
-        if app is not None:
-            app.stop()
         raise
 
 if __name__ == "__main__":
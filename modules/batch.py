@@ -0,0 +1,180 @@
+"""Precomputes the answers to frequent questions with the Gemini Batch API, filling the local response cache."""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from google.genai import types
+
+from modules import state
+from modules.cache import get_cached_response, response_cache_key, store_cached_response
+from modules.gemini import _GENERATION_CONFIG
+
+# Batch jobs complete within 24 hours, results are checked periodically
+_POLL_INTERVAL_SECONDS = 60
+_MAX_WAIT_SECONDS = 86400
+
+_FAILED_JOB_STATES = (
+    types.JobState.JOB_STATE_FAILED,
+    types.JobState.JOB_STATE_CANCELLED,
+    types.JobState.JOB_STATE_EXPIRED,
+)
+
+# A single warmup runs at any given time
+_WARMUP_LOCK = threading.Lock()
+
+
+def load_warmup_questions(file_path) -> list[str]:
+    """Reads one question per line from the warmup file, empty lines are ignored"""
+    try:
+        with open(file_path, "r", encoding="utf-8") as questions_file:
+            return [line.strip() for line in questions_file if line.strip()]
+    except OSError as e:
+        logging.error("Cannot read the warmup questions from [%s]: %s", file_path, e)
+        return []
+
+
+def _build_batch_request(user_request: str, source_files) -> dict:
+    """
+    Builds the JSONL request for a question, same as the interactive query.
+    The files are referenced directly, the context cache is replaced by reloads while the job runs.
+    """
+    file_parts = [{"file_data": {"file_uri": f.uri, "mime_type": f.mime_type}} for f in source_files]
+    return {
+        "contents": [{"role": "user", "parts": [*file_parts, {"text": user_request}]}],
+        "system_instruction": {"parts": [{"text": state.SYSTEM_INSTRUCTION}]},
+        "generation_config": _GENERATION_CONFIG.model_dump(exclude_none=True),
+    }
+
+
+def _submit_batch(pending: dict[str, str], source_files):
+    """Uploads the requests file and creates the batch job"""
+    with tempfile.NamedTemporaryFile("w", suffix=".jsonl", encoding="utf-8", delete=False) as requests_file:
+        for cache_key, user_request in pending.items():
+            requests_file.write(json.dumps({"key": cache_key, "request": _build_batch_request(user_request, source_files)}) + "\n")
+        requests_path = requests_file.name
+
+    try:
+        uploaded_requests = state.GEMINI_CLIENT.files.upload(
+            file=requests_path,
+            config={
+                'display_name': "warmup-requests.jsonl",
+                'mime_type': "application/jsonl",
+            }
+        )
+    finally:
+        os.remove(requests_path)
+    # Reloads must not delete the input of the job
+    state.BATCH_FILE_NAMES.add(uploaded_requests.name)
+
+    batch_job = state.GEMINI_CLIENT.batches.create(
+        model=state.GOOGLE_API_MODEL,
+        src=uploaded_requests.name,
+        config={'display_name': "response-cache-warmup"},
+    )
+    logging.info("Warmup batch job [%s] created for %i questions", batch_job.name, len(pending))
+    return batch_job, uploaded_requests
+
+
+def _wait_batch(batch_job):
+    """Polls the batch job until it ends or the maximum wait is reached"""
+    deadline = time.monotonic() + _MAX_WAIT_SECONDS
+    while not batch_job.done:
+        if time.monotonic() > deadline:
+            logging.error("Warmup batch job [%s] did not complete in time", batch_job.name)
+            return None
+        time.sleep(_POLL_INTERVAL_SECONDS)
+        batch_job = state.GEMINI_CLIENT.batches.get(name=batch_job.name)
+        logging.debug("Warmup batch job [%s] is in state [%s]", batch_job.name, batch_job.state)
+    return batch_job
+
+
+def _store_batch_results(batch_job, fingerprint: str) -> int:
+    """Downloads the results file and stores every answer in the response cache"""
+    if state.SOURCES_FINGERPRINT != fingerprint:
+        logging.warning("Sources changed while the warmup batch job was running, discarding its results")
+        return 0
+
+    results = state.GEMINI_CLIENT.files.download(file=batch_job.dest.file_name)
+    stored = 0
+    for line in results.decode("utf-8").splitlines():
+        if not line.strip():
+            continue
+        try:
+            result = json.loads(line)
+            if "response" not in result:
+                logging.warning("Warmup request [%s] failed: %s", result.get("key"), result.get("error"))
+                continue
+            response_text = (types.GenerateContentResponse.model_validate(result["response"]).text or "").strip()
+        except (ValueError, TypeError) as e:
+            logging.warning("Cannot parse a warmup result: %s", e)
+            continue
+        if response_text:
+            store_cached_response(result["key"], response_text)
+            stored += 1
+    return stored
+
+
+def warmup_response_cache(questions: list[str]) -> None:
+    """
+    Answers the given questions with a single batch job, at a lower cost than interactive queries,
+    and stores the answers in the response cache. Questions already cached are skipped.
+    """
+    if not _WARMUP_LOCK.acquire(blocking=False):
+        logging.info("A warmup is already running, skipping")
+        return
+
+    try:
+        if not state.uploaded_files:
+            logging.warning("No sources are loaded, skipping the warmup")
+            return
+
+        # Snapshot of the sources, kept on the cloud by reloads until the job ends
+        source_files = state.uploaded_files
+        fingerprint = state.SOURCES_FINGERPRINT
+        pending = {}
+        for question in questions:
+            cache_key = response_cache_key(question)
+            if get_cached_response(cache_key) is None:
+                pending[cache_key] = question
+        if not pending:
+            logging.info("All the %i warmup questions are already cached", len(questions))
+            return
+
+        uploaded_requests = None
+        state.BATCH_FILE_NAMES.update(source_file.name for source_file in source_files)
+        try:
+            batch_job, uploaded_requests = _submit_batch(pending, source_files)
+            batch_job = _wait_batch(batch_job)
+            if batch_job is None:
+                return
+            if batch_job.state in _FAILED_JOB_STATES:
+                logging.error("Warmup batch job [%s] ended in state [%s]: %s", batch_job.name, batch_job.state, batch_job.error)
+                return
+            stored = _store_batch_results(batch_job, fingerprint)
+            logging.info("Warmup completed, %i of %i answers cached", stored, len(pending))
+        except Exception as e:
+            logging.error("Failed to warm up the response cache: %s", e)
+        finally:
+            # Files no longer referenced are removed by the next reload
+            state.BATCH_FILE_NAMES.clear()
+            if uploaded_requests is not None:
+                try:
+                    state.GEMINI_CLIENT.files.delete(name=uploaded_requests.name)
+                except Exception as e:
+                    logging.warning("Failed to delete the warmup requests file [%s]: %s", uploaded_requests.name, e)
+    finally:
+        _WARMUP_LOCK.release()
+
+
+def start_warmup() -> None:
+    """Starts the warmup in a background thread if a questions file is configured"""
+    if not state.GEMINI_WARMUP_FILE:
+        return
+
+    questions = load_warmup_questions(state.GEMINI_WARMUP_FILE)
+    if questions:
+        threading.Thread(target=warmup_response_cache, args=(questions,), daemon=True).start()
@@ -0,0 +1,47 @@
+"""Local cache of Gemini answers, shared by all the users asking the same question."""
+
+import hashlib
+import logging
+import re
+
+import diskcache
+
+from modules import state
+
+CACHE_DIRECTORY = "./.cache"
+RESPONSE_TTL_SECONDS = 86400
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+_response_cache = diskcache.Cache(CACHE_DIRECTORY)
+
+
+def _normalize_request(user_request: str) -> str:
+    """Makes requests differing only by case or spacing share the same entry"""
+    return _WHITESPACE_RE.sub(" ", user_request).strip().casefold()
+
+
+def response_cache_key(user_request: str) -> str:
+    """
+    Builds the cache key for a request, bound to the model and to the uploaded sources
+    so that answers are not reused once the documents change.
+    """
+    key_source = "\n".join((_normalize_request(user_request), state.GOOGLE_API_MODEL, state.SOURCES_FINGERPRINT))
+    return hashlib.sha256(key_source.encode("utf-8")).hexdigest()
+
+
+def get_cached_response(cache_key: str) -> str | None:
+    """Returns the cached answer for the key, None if missing or if the cache is not readable"""
+    try:
+        return _response_cache.get(cache_key)
+    except Exception as e:
+        logging.warning("Failed to read the response cache: %s", e)
+        return None
+
+
+def store_cached_response(cache_key: str, response_text: str) -> None:
+    """Stores the answer for the key, failures only disable caching for this answer"""
+    try:
+        _response_cache.set(cache_key, response_text, expire=RESPONSE_TTL_SECONDS)
+    except Exception as e:
+        logging.warning("Failed to write the response cache: %s", e)
@@ -1,21 +1,21 @@
 # Custom exceptions
-class GeminiModelCreationException(BaseException):
+class GeminiModelCreationException(Exception):
     """Used to identify errors from Gemini"""
 
 
-class GeminiApiInitializeException(BaseException):
+class GeminiApiInitializeException(Exception):
     """Used to identify initialization errors"""
 
 
-class GeminiRagUploadException(BaseException):
+class GeminiRagUploadException(Exception):
     """Used to identify files upload errors"""
 
 
-class GeminiFilesListingException(BaseException):
+class GeminiFilesListingException(Exception):
     """Used to identify files upload errors"""
 
 
-class GeminiQueryException(BaseException):
+class GeminiQueryException(Exception):
     """Used to identify files expired errors"""
 
 
@@ -1,49 +1,113 @@
+import asyncio
+import base64
+import hashlib
 import logging
 import os
 import mimetypes
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 
 from google import genai
 from google.genai import types
 
 from modules import state
+from modules.cache import get_cached_response, response_cache_key, store_cached_response
 from modules.exceptions import (
     GeminiApiInitializeException,
     GeminiFilesListingException,
     GeminiQueryException,
     GeminiRagUploadException,
 )
-from modules.repos import clone_or_pull_repo, list_files_in_folder
+from modules.repos import list_files_in_folder
 
 mimetypes.add_type("text/markdown", ".md")
 
-def gemini_initialize() -> None:
-    """Initializes the Gemini AI parameters"""
+# Files already on the cloud are reused only if they outlive the next daily reload
+_REUSE_MIN_LIFETIME = timedelta(hours=25)
+
+# Lifetime of the context cache holding the sources, refreshed periodically by the scheduler
+_CACHE_TTL = "3600s"
+
+# Generation parameters are the same for every query
+_GENERATION_CONFIG = types.GenerateContentConfig(
+    candidate_count=1,
+    temperature=1,
+    top_p=0.95,
+    top_k=40,
+    max_output_tokens=4096,
+)
 
+def _upload_source_file(source_file):
+    """Uploads a single source file, returns None if the upload failed"""
     try:
-        # Configure Gemini API
-        logging.info("Configuring Gemini API from environment")
-        state.GEMINI_CLIENT = genai.Client(api_key=state.GOOGLE_API_KEY)
-        # Initialize the Gemini model
-        logging.info("Initializing Gemini client for model [%s]", state.GOOGLE_API_MODEL)
+        logging.info("Uploading source file: [%s]", source_file)
+        mime_type = mimetypes.guess_type(source_file)[0] or "text/markdown"
+        uploaded_file = state.GEMINI_CLIENT.files.upload(
+            file=source_file,
+            config={
+                'display_name': os.path.basename(source_file),
+                'mime_type': mime_type,
+            }
+        )
+        logging.info("Source file [%s] uploaded successfully. Expire date: [%s]", source_file, uploaded_file.expiration_time)
+        return uploaded_file
     except Exception as e:
-        logging.critical("Failed to initialize Gemini client: %s", e)
-        raise GeminiApiInitializeException(e) from e
+        logging.warning("Failed to upload file [%s]: %s", source_file, e)
+        return None
+
+
+def _delete_cloud_file(file_to_delete) -> None:
+    """Deletes a previously uploaded file, failures are logged and ignored"""
+    try:
+        logging.info("Deleting old file [%s] uploaded on [%s] with hash [%s]", file_to_delete.name, file_to_delete.create_time, file_to_delete.sha256_hash)
+        state.GEMINI_CLIENT.files.delete(name=file_to_delete.name)
+        logging.debug("File [%s] was deleted", file_to_delete.name)
+    except Exception as e:
+        logging.error("Failed to delete file [%s] from the cloud: %s", file_to_delete.name, e)
+
+
+def _local_file_hashes(source_file) -> set[str]:
+    """Returns the base64 encodings of the file SHA-256 the Files API may report, empty if unreadable"""
+    try:
+        with open(source_file, "rb") as source:
+            digest = hashlib.sha256(source.read())
+    except OSError as e:
+        logging.warning("Cannot compute the hash of [%s]: %s", source_file, e)
+        return set()
+    return {
+        base64.b64encode(digest.digest()).decode("ascii"),
+        base64.b64encode(digest.hexdigest().encode("ascii")).decode("ascii"),
+    }
+
+
+def _is_reusable(cloud_file, min_expiration: datetime) -> bool:
+    """Checks if an uploaded file is usable and will not expire too soon"""
+    if cloud_file.state is not None and cloud_file.state != types.FileState.ACTIVE:
+        return False
+    return cloud_file.expiration_time is None or cloud_file.expiration_time > min_expiration
+
+
+def gemini_initialize() -> None:
+    """Initializes the Gemini AI parameters"""
+
+    if state.GEMINI_CLIENT is None:
+        try:
+            # Configure Gemini API, the client and its connection pool are kept across reloads
+            logging.info("Configuring Gemini API from environment")
+            state.GEMINI_CLIENT = genai.Client(api_key=state.GOOGLE_API_KEY)
+            # Initialize the Gemini model
+            logging.info("Initializing Gemini client for model [%s]", state.GOOGLE_API_MODEL)
+        except Exception as e:
+            logging.critical("Failed to initialize Gemini client: %s", e)
+            raise GeminiApiInitializeException(e) from e
 
     try:
         # Get the list of uploaded files to the cloud
         logging.debug("Retrieving the list of files that are currently on the cloud")
-        existing_files_on_cloud = state.GEMINI_CLIENT.files.list()
-
-        # Delete existing files
-        for file_to_delete in existing_files_on_cloud:
-            logging.info("Deleting old file [%s] uploaded on [%s] with hash [%s]", file_to_delete.name, file_to_delete.create_time, file_to_delete.sha256_hash)
-            state.GEMINI_CLIENT.files.delete(name=file_to_delete.name)
-            logging.debug("File [%s] was deleted", file_to_delete.name)
+        existing_files_on_cloud = list(state.GEMINI_CLIENT.files.list())
     except Exception as e:
-        logging.error("Failed to delete existing files on the cloud: %s", e)
-
-    # Clone or pull the repository
-    clone_or_pull_repo()
+        logging.error("Failed to list existing files on the cloud: %s", e)
+        existing_files_on_cloud = []
 
     # List of file paths to upload as source
     try:
@@ -54,54 +118,166 @@ def gemini_initialize() -> None:
         logging.critical("Cannot retrieve documents from cloned repository, error: %s", e)
         raise GeminiFilesListingException(e) from e
 
-    # Make sure list is empty in case of new uploads
-    state.uploaded_files.clear()
+    # Match the local files with the cloud files having the same content
+    min_expiration = datetime.now(timezone.utc) + _REUSE_MIN_LIFETIME
+    reusable_files = {
+        cloud_file.sha256_hash: cloud_file
+        for cloud_file in existing_files_on_cloud
+        if cloud_file.sha256_hash and _is_reusable(cloud_file, min_expiration)
+    }
+    reused_files = {}
+    for source_file in source_file_paths:
+        for file_hash in _local_file_hashes(source_file):
+            if file_hash in reusable_files:
+                reused_files[source_file] = reusable_files[file_hash]
+                logging.info("Source file [%s] is unchanged, reusing [%s]", source_file, reused_files[source_file].name)
+                break
+    reused_names = {cloud_file.name for cloud_file in reused_files.values()}
+
+    # Upload the changed files in parallel
+    files_to_upload = [source_file for source_file in source_file_paths if source_file not in reused_files]
+    new_files = {}
+    if files_to_upload:
+        with ThreadPoolExecutor(max_workers=min(state.GEMINI_UPLOAD_CONCURRENCY, len(files_to_upload))) as executor:
+            new_files = dict(zip(files_to_upload, executor.map(_upload_source_file, files_to_upload)))
+    logging.info("Reused %i files, uploaded %i files", len(reused_files), len([f for f in new_files.values() if f is not None]))
 
-    # Upload each file and store the uploaded file references
+    # Collect the file references in the listing order
+    uploaded_files = []
+    added_names = set()
     for source_file in source_file_paths:
-        try:
-            logging.info("Uploading source file: [%s]", source_file)
-            mime_type = mimetypes.guess_type(source_file)[0] or "text/markdown"
-            uploaded_file = state.GEMINI_CLIENT.files.upload(
-                file=source_file,
-                config={
-                    'display_name': os.path.basename(source_file),
-                    'mime_type': mime_type,
-                }
-            )
-            state.uploaded_files.append(uploaded_file)
-            logging.info("Source file [%s] uploaded successfully. Expire date: [%s]", source_file, uploaded_file.expiration_time)
-        except Exception as e:
-            logging.warning("Failed to upload file [%s]: %s", source_file, e)
-    if len(state.uploaded_files) > 0:
-        logging.info("Uploaded %i files to Gemini AI", len(state.uploaded_files))
+        uploaded_file = reused_files.get(source_file) or new_files.get(source_file)
+        if uploaded_file is not None and uploaded_file.name not in added_names:
+            uploaded_files.append(uploaded_file)
+            added_names.add(uploaded_file.name)
+
+    # Publish an immutable snapshot in a single assignment, queries used the previous files until now
+    state.uploaded_files = tuple(uploaded_files)
+
+    # Delete the outdated files in parallel, except the ones a running batch job still needs
+    kept_names = reused_names | set(state.BATCH_FILE_NAMES)
+    files_to_delete = [cloud_file for cloud_file in existing_files_on_cloud if cloud_file.name not in kept_names]
+    if files_to_delete:
+        with ThreadPoolExecutor(max_workers=min(state.GEMINI_UPLOAD_CONCURRENCY, len(files_to_delete))) as executor:
+            list(executor.map(_delete_cloud_file, files_to_delete))
+
+    if len(uploaded_files) > 0:
+        state.SOURCES_FINGERPRINT = ",".join(sorted(uploaded_file.sha256_hash or uploaded_file.name for uploaded_file in uploaded_files))
+        logging.info("Using %i files on Gemini AI", len(state.uploaded_files))
+        _create_sources_cache()
     else:
         raise GeminiRagUploadException("No valid files could be uploaded to Gemini AI")
 
 
-async def gemini_query_sources(user_request):
-    """Queries the uploaded PDFs with the given prompt."""
-    instruction = f"You are `{state.TELEGRAM_BOT_NAME}`, a chatbot that can only answer to users request based solely on the source documents. Reply to the following message using the same language, when returning LaTex formulas, try to translate them to simple text if possible."
-    user_request = f"{instruction}:\n\n`{user_request}`"
-    logging.debug("Generated prompt: [%s]", user_request)
+def gemini_sources_valid() -> bool:
+    """Checks if sources are loaded and none of them expires before the next daily reload"""
+    min_expiration = datetime.now(timezone.utc) + _REUSE_MIN_LIFETIME
+    uploaded_files = state.uploaded_files
+    return len(uploaded_files) > 0 and all(_is_reusable(uploaded_file, min_expiration) for uploaded_file in uploaded_files)
+
+
+def _set_gemini_ready(ready: bool) -> None:
+    """Sets or clears gemini_ready, waking up the waiting queries, from any thread"""
+    update_event = state.gemini_ready.set if ready else state.gemini_ready.clear
+    if state.EVENT_LOOP is None or state.EVENT_LOOP.is_closed():
+        # The bot is not running yet, nobody can be waiting
+        update_event()
+    else:
+        state.EVENT_LOOP.call_soon_threadsafe(update_event)
+
+
+def gemini_reload() -> None:
+    """Runs gemini_initialize while queries wait for it, after any reload already running"""
+    with state.GEMINI_RELOAD_LOCK:
+        _set_gemini_ready(False)
+        try:
+            gemini_initialize()
+        finally:
+            _set_gemini_ready(True)
+
+
+async def gemini_initialize_async() -> None:
+    """Runs gemini_reload in a worker thread, so its blocking file calls do not stall the event loop"""
+    await asyncio.to_thread(gemini_reload)
+
+
+def _create_sources_cache() -> None:
+    """
+    Stores the uploaded sources and the instruction in a Gemini context cache,
+    so queries only have to send the user message.
+    Queries fall back to sending the files inline if the cache cannot be created.
+    """
+    previous_cache_name = state.GEMINI_CACHE_NAME
+    try:
+        logging.debug("Creating the context cache for the uploaded sources")
+        cached_content = state.GEMINI_CLIENT.caches.create(
+            model=state.GOOGLE_API_MODEL,
+            config=types.CreateCachedContentConfig(
+                contents=list(state.uploaded_files),
+                system_instruction=state.SYSTEM_INSTRUCTION,
+                ttl=_CACHE_TTL,
+            ),
+        )
+        state.GEMINI_CACHE_NAME = cached_content.name
+        logging.info("Sources cached as [%s], expire date: [%s]", cached_content.name, cached_content.expire_time)
+    except Exception as e:
+        state.GEMINI_CACHE_NAME = None
+        logging.warning("Cannot cache the sources, files will be sent with every query: %s", e)
+
+    if previous_cache_name:
+        try:
+            state.GEMINI_CLIENT.caches.delete(name=previous_cache_name)
+            logging.debug("Previous context cache [%s] was deleted", previous_cache_name)
+        except Exception as e:
+            logging.warning("Failed to delete previous context cache [%s]: %s", previous_cache_name, e)
+
+
+def gemini_refresh_cache() -> None:
+    """Extends the lifetime of the sources cache, so it does not expire between reloads"""
+    if not state.GEMINI_CACHE_NAME or not state.GEMINI_RELOAD_LOCK.acquire(blocking=False):
+        # A running reload creates a new cache anyway
+        return
 
     try:
-        # Create the model config
-        model_config = types.GenerateContentConfig(
-            candidate_count=1,
-            temperature=1,
-            top_p=0.95,
-            top_k=40,
-            max_output_tokens=4096,
+        state.GEMINI_CLIENT.caches.update(
+            name=state.GEMINI_CACHE_NAME,
+            config=types.UpdateCachedContentConfig(ttl=_CACHE_TTL),
         )
+        logging.debug("Context cache [%s] refreshed", state.GEMINI_CACHE_NAME)
+    except Exception as e:
+        logging.warning("Failed to refresh context cache [%s]: %s", state.GEMINI_CACHE_NAME, e)
+    finally:
+        state.GEMINI_RELOAD_LOCK.release()
 
+
+async def gemini_query_sources(user_request):
+    """Queries the uploaded PDFs with the given prompt."""
+    cache_key = response_cache_key(user_request)
+    # diskcache blocks on SQLite while the warmup writes to it, keep it off the event loop
+    cached_response = await asyncio.to_thread(get_cached_response, cache_key)
+    if cached_response is not None:
+        logging.info("Serving [%i] characters response from the local cache", len(cached_response))
+        return cached_response
+
+    if state.GEMINI_CACHE_NAME:
+        # Sources and instruction are already part of the cached context
+        contents = [user_request]
+        config = _GENERATION_CONFIG.model_copy(update={"cached_content": state.GEMINI_CACHE_NAME})
+    else:
+        contents = [*state.uploaded_files, user_request]
+        config = _GENERATION_CONFIG.model_copy(update={"system_instruction": state.SYSTEM_INSTRUCTION})
+    logging.debug("Generated prompt: [%s]", contents[-1])
+
+    try:
         response = await state.GEMINI_CLIENT.aio.models.generate_content(
             model=state.GOOGLE_API_MODEL,
-            contents=[*state.uploaded_files, user_request],
-            config=model_config
+            contents=contents,
+            config=config
         )
         response_text = response.text.strip()
         logging.info("Successfully retrieved [%i] characters response from Gemini API", len(response_text))
+        if response_text:
+            await asyncio.to_thread(store_cached_response, cache_key, response_text)
         return response_text
     except Exception as e:
         logging.error("Failed to query Gemini API: %s", e)
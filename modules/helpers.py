@@ -1,22 +1,52 @@
 
+import functools
 import io
 import re
+import threading
 
-import matplotlib
-import matplotlib.pyplot as plt
+ZERO_WIDTH_SPACE = "\u200b"
 
-from telegram.helpers import escape_markdown
+# Characters escaped by Telegram MarkdownV2 outside of code entities
+_MARKDOWN_V2_ESCAPE_TABLE = str.maketrans({char: f"\\{char}" for char in "\\_*[]()~`>#+-=|{}.!"})
+# Characters escaped inside pre and code entities
+_MARKDOWN_V2_CODE_ESCAPE_TABLE = str.maketrans({char: f"\\{char}" for char in "\\`"})
 
-matplotlib.use("Agg")
+# Any of the characters escaped by Telegram MarkdownV2
+_MARKDOWN_V2_SPECIAL_RE = re.compile(r"[\\_*\[\]()~`>#+\-=|{}.!]")
 
-ZERO_WIDTH_SPACE = "\u200b"
+# Markdown constructs converted by _format_markdown_v2, in the order they are applied
+_CODE_BLOCK_RE = re.compile(r"```(\w+)?\n([\s\S]*?)```", re.MULTILINE)
+_INLINE_CODE_RE = re.compile(r"`([^`\n]+)`")
+_LINK_RE = re.compile(r"\[([^\]]+)\]\(([^)]+)\)")
+_BOLD_RE = re.compile(r"\*\*([^*\n]+)\*\*")
+_UNDERLINE_RE = re.compile(r"__([^_\n]+)__")
+_ITALIC_STAR_RE = re.compile(r"(?<!\*)\*([^*\n]+)\*(?!\*)")
+_ITALIC_UNDER_RE = re.compile(r"(?<!_)_([^_\n]+)_(?!_)")
+_STRIKE_RE = re.compile(r"~~([^~\n]+)~~")
+_SPOILER_RE = re.compile(r"\|\|([^|\n]+)\|\|")
+
+# Places reporting flood control errors that cannot be recovered without a restart
+_FLOOD_CONTROL_ORIGIN_RE = re.compile(r"Network Retry Loop|Polling Updates")
+
+# Non-escaped $$...$$ blocks and $...$ inline formulas
+_LATEX_RE = re.compile(r"(?<!\\)\$\$(?P<block>.+?)(?<!\\)\$\$|(?<!\\)\$(?P<inline>.+?)(?<!\\)\$", re.DOTALL)
+
+# matplotlib is not thread safe, renders from worker threads must not overlap
+_LATEX_RENDER_LOCK = threading.Lock()
 
 
 def escape_telegram_markdown(text: str) -> str:
     """
     Escapes special characters in the text for Telegram MarkdownV2.
     """
-    return escape_markdown(text, version=2)
+    return text.translate(_MARKDOWN_V2_ESCAPE_TABLE)
+
+
+def is_plain_text(text: str) -> bool:
+    """
+    Checks if the text can be sent without parse mode, as it has no MarkdownV2 special characters.
+    """
+    return _MARKDOWN_V2_SPECIAL_RE.search(text) is None
 
 
 def _format_markdown_v2(text: str) -> str:
@@ -36,82 +66,70 @@ def _format_markdown_v2(text: str) -> str:
         return key
 
     # Code blocks
-    code_block_pattern = re.compile(r"```(\w+)?\n([\s\S]*?)```", re.MULTILINE)
-
     def replace_code_block(match: re.Match) -> str:
         language = match.group(1) or ""
         code = match.group(2)
-        escaped_code = escape_markdown(code, version=2, entity_type="pre")
+        escaped_code = code.translate(_MARKDOWN_V2_CODE_ESCAPE_TABLE)
         if language:
             return add_placeholder(f"```{language}\n{escaped_code}```")
         return add_placeholder(f"```\n{escaped_code}```")
 
-    normalized_text = code_block_pattern.sub(replace_code_block, normalized_text)
+    normalized_text = _CODE_BLOCK_RE.sub(replace_code_block, normalized_text)
 
     # Inline code
-    inline_code_pattern = re.compile(r"`([^`\n]+)`")
-
     def replace_inline_code(match: re.Match) -> str:
         code = match.group(1)
-        escaped_code = escape_markdown(code, version=2, entity_type="code")
+        escaped_code = code.translate(_MARKDOWN_V2_CODE_ESCAPE_TABLE)
         return add_placeholder(f"`{escaped_code}`")
 
-    normalized_text = inline_code_pattern.sub(replace_inline_code, normalized_text)
+    normalized_text = _INLINE_CODE_RE.sub(replace_inline_code, normalized_text)
 
     # Links
-    link_pattern = re.compile(r"\[([^\]]+)\]\(([^)]+)\)")
-
     def replace_link(match: re.Match) -> str:
-        label = escape_markdown(match.group(1), version=2)
+        label = escape_telegram_markdown(match.group(1))
         url = match.group(2).replace("\\", "\\\\").replace(")", "\\)")
         return add_placeholder(f"[{label}]({url})")
 
-    normalized_text = link_pattern.sub(replace_link, normalized_text)
+    normalized_text = _LINK_RE.sub(replace_link, normalized_text)
 
     # Bold **text**
-    normalized_text = re.sub(
-        r"\*\*([^*\n]+)\*\*",
-        lambda m: add_placeholder(f"*{escape_markdown(m.group(1), version=2)}*"),
+    normalized_text = _BOLD_RE.sub(
+        lambda m: add_placeholder(f"*{escape_telegram_markdown(m.group(1))}*"),
         normalized_text,
     )
 
     # Underline __text__
-    normalized_text = re.sub(
-        r"__([^_\n]+)__",
-        lambda m: add_placeholder(f"__{escape_markdown(m.group(1), version=2)}__"),
+    normalized_text = _UNDERLINE_RE.sub(
+        lambda m: add_placeholder(f"__{escape_telegram_markdown(m.group(1))}__"),
         normalized_text,
     )
 
     # Italic *text*
-    normalized_text = re.sub(
-        r"(?<!\*)\*([^*\n]+)\*(?!\*)",
-        lambda m: add_placeholder(f"_{escape_markdown(m.group(1), version=2)}_"),
+    normalized_text = _ITALIC_STAR_RE.sub(
+        lambda m: add_placeholder(f"_{escape_telegram_markdown(m.group(1))}_"),
         normalized_text,
     )
 
     # Italic _text_
-    normalized_text = re.sub(
-        r"(?<!_)_([^_\n]+)_(?!_)",
-        lambda m: add_placeholder(f"_{escape_markdown(m.group(1), version=2)}_"),
+    normalized_text = _ITALIC_UNDER_RE.sub(
+        lambda m: add_placeholder(f"_{escape_telegram_markdown(m.group(1))}_"),
         normalized_text,
     )
 
     # Strikethrough ~~text~~
-    normalized_text = re.sub(
-        r"~~([^~\n]+)~~",
-        lambda m: add_placeholder(f"~{escape_markdown(m.group(1), version=2)}~"),
+    normalized_text = _STRIKE_RE.sub(
+        lambda m: add_placeholder(f"~{escape_telegram_markdown(m.group(1))}~"),
         normalized_text,
     )
 
     # Spoiler ||text||
-    normalized_text = re.sub(
-        r"\|\|([^|\n]+)\|\|",
-        lambda m: add_placeholder(f"||{escape_markdown(m.group(1), version=2)}||"),
+    normalized_text = _SPOILER_RE.sub(
+        lambda m: add_placeholder(f"||{escape_telegram_markdown(m.group(1))}||"),
         normalized_text,
     )
 
     # Escape remaining text
-    escaped_text = escape_markdown(normalized_text, version=2)
+    escaped_text = escape_telegram_markdown(normalized_text)
 
     # Restore placeholders
     for key, value in placeholders.items():
@@ -120,10 +138,27 @@ def _format_markdown_v2(text: str) -> str:
     return escaped_text
 
 
+def is_flood_control(error_message: str) -> bool:
+    """Checks if a Telegram error message reports a flood control error"""
+    return "Flood control exceeded" in error_message
+
+
+def flood_control_origins(error_message: str) -> frozenset[str]:
+    """
+    Returns the loops named by a Telegram flood control error ("Network Retry Loop", "Polling Updates"),
+    empty if the message is not a flood control error or names none of them.
+    """
+    if not is_flood_control(error_message):
+        return frozenset()
+    return frozenset(_FLOOD_CONTROL_ORIGIN_RE.findall(error_message))
+
+
 def remove_markdown(text: str) -> str:
     """
     Removes Markdown formatting from the text.
     """
+    if "*" not in text and "_" not in text:
+        return text
     text = text.replace("**", "")
     text = text.replace("__", "")
     return text
@@ -141,26 +176,42 @@ def _split_telegram_message(text: str, limit: int = 4096) -> list[str]:
         return [text]
 
     chunks = []
-    remaining = text
+    text_length = len(text)
+    # Work on offsets in the original text instead of copying the remaining part after each chunk
+    start = 0
 
-    while len(remaining) > limit:
-        split_index = remaining.rfind("\n\n", 0, limit)
+    while text_length - start > limit:
+        end = start + limit
+        split_index = text.rfind("\n\n", start, end)
         if split_index == -1:
-            split_index = remaining.rfind("\n", 0, limit)
-        if split_index == -1 or split_index < 1:
-            split_index = limit
+            split_index = text.rfind("\n", start, end)
+        if split_index == -1 or split_index < start + 1:
+            split_index = end
 
-        chunk = remaining[:split_index].strip()
+        chunk = text[start:split_index].strip()
         if chunk:
             chunks.append(chunk)
-        remaining = remaining[split_index:].lstrip()
 
-    if remaining:
-        chunks.append(remaining)
+        # Skip the whitespace at the beginning of the next chunk
+        start = split_index
+        while start < text_length and text[start].isspace():
+            start += 1
+
+    if start < text_length:
+        chunks.append(text[start:])
 
     return chunks
 
 
+@functools.lru_cache(maxsize=256)
+def format_telegram_chunks(text: str) -> tuple[str, ...]:
+    """
+    Converts the text to MarkdownV2 and splits it into messages within Telegram's size limit.
+    Results are memoized, so resent texts are neither converted nor split again.
+    """
+    return tuple(_split_telegram_message(_format_markdown_v2(text).strip()))
+
+
 def split_text_with_latex(text: str) -> list[tuple[str, str]]:
     """
     Splits text into a sequence of (type, content), where type is 'text' or 'latex'.
@@ -169,19 +220,15 @@ def split_text_with_latex(text: str) -> list[tuple[str, str]]:
     if not text:
         return [("text", "")]
 
-    pattern = re.compile(r"(?<!\\)\$\$(.+?)(?<!\\)\$\$|(?<!\\)\$(.+?)(?<!\\)\$", re.DOTALL)
     segments: list[tuple[str, str]] = []
     last_index = 0
 
-    for match in pattern.finditer(text):
+    for match in _LATEX_RE.finditer(text):
         start, end = match.span()
         if start > last_index:
             segments.append(("text", text[last_index:start]))
 
-        latex_content = match.group(1) if match.group(1) is not None else match.group(2)
-        if latex_content is None:
-            latex_content = ""
-        segments.append(("latex", latex_content))
+        segments.append(("latex", match.group("block") or match.group("inline") or ""))
         last_index = end
 
     if last_index < len(text):
@@ -190,10 +237,12 @@ def split_text_with_latex(text: str) -> list[tuple[str, str]]:
     return segments
 
 
+@functools.lru_cache(maxsize=512)
 def render_latex_to_png_bytes(latex: str, fontsize: int = 14, dpi: int = 200) -> bytes | None:
     """
     Renders LaTeX to PNG bytes using matplotlib's mathtext.
     Returns None if rendering fails.
+    Safe to call from worker threads, repeated formulas are served from memory.
     """
     if latex is None:
         return None
@@ -204,22 +253,23 @@ def render_latex_to_png_bytes(latex: str, fontsize: int = 14, dpi: int = 200) ->
 
     latex = latex.replace("\n", " \\ ")
 
-    try:
-        fig = plt.figure(figsize=(0.01, 0.01))
-        fig.patch.set_alpha(0)
-        text = fig.text(0, 0, f"${latex}$", fontsize=fontsize)
-        fig.canvas.draw()
-        bbox = text.get_window_extent()
-        width, height = bbox.size / dpi
-        fig.set_size_inches((width, height))
-        buf = io.BytesIO()
-        fig.savefig(buf, format="png", dpi=dpi, bbox_inches="tight", pad_inches=0.1, transparent=True)
-        plt.close(fig)
-        buf.seek(0)
-        return buf.getvalue()
-    except (RuntimeError, ValueError, OSError):
+    # matplotlib is slow to import and only needed when a reply contains LaTeX
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    with _LATEX_RENDER_LOCK:
         try:
-            plt.close("all")
+            # A standalone figure skips the pyplot figure manager and needs no explicit close
+            fig = Figure(figsize=(0.01, 0.01))
+            FigureCanvasAgg(fig)
+            fig.patch.set_alpha(0)
+            text = fig.text(0, 0, f"${latex}$", fontsize=fontsize)
+            fig.canvas.draw()
+            bbox = text.get_window_extent()
+            width, height = bbox.size / dpi
+            fig.set_size_inches((width, height))
+            buf = io.BytesIO()
+            fig.savefig(buf, format="png", dpi=dpi, bbox_inches="tight", pad_inches=0.1, transparent=True)
+            return buf.getvalue()
         except (RuntimeError, ValueError, OSError):
-            pass
-        return None
+            return None
@@ -1,14 +1,103 @@
 
+import functools
 import logging
 import os
 import shutil
-import time
 
 import git
 
 from modules import state
 
 
+# Only the current tree is needed, history, tags and other branches are not fetched
+_CLONE_OPTIONS = ["--depth=1", "--filter=blob:none", "--single-branch", "--no-tags", "--no-checkout"]
+
+# Only the documents are checked out, with the blobless clone other files are never downloaded
+_SPARSE_CHECKOUT_PATTERNS = "*.[mM][dD]\n"
+
+
+def _enable_sparse_checkout(repo):
+    """Restricts the working tree of the repository to the markdown files"""
+    repo.git.config("core.sparseCheckout", "true")
+    with open(os.path.join(repo.git_dir, "info", "sparse-checkout"), "w", encoding="utf-8") as patterns_file:
+        patterns_file.write(_SPARSE_CHECKOUT_PATTERNS)
+    repo.git.read_tree("-mu", "HEAD")
+
+
+def _ensure_sparse_checkout():
+    """
+    Enables the sparse checkout on clones made before it was introduced.
+    If it fails the clone is removed, so that it is cloned again.
+    """
+    if os.path.exists(os.path.join(state.LOCAL_REPO_PATH, ".git", "info", "sparse-checkout")):
+        return
+    try:
+        logging.info("Enabling the sparse checkout of the existing clone")
+        with git.Repo(state.LOCAL_REPO_PATH) as repo:
+            _enable_sparse_checkout(repo)
+    except Exception as e:
+        logging.warning("Failed to enable the sparse checkout, removing the clone: %s", e)
+        shutil.rmtree(state.LOCAL_REPO_PATH, ignore_errors=True)
+
+
+def _clone_repo():
+    """Makes a shallow and partial clone of the sources repository, checking out only the documents"""
+    repo = git.Repo.clone_from(state.REPO_URL, state.LOCAL_REPO_PATH, multi_options=_CLONE_OPTIONS)
+    try:
+        with repo:
+            _enable_sparse_checkout(repo)
+    except Exception:
+        # Without its working tree the clone would look up to date, it's cloned again on the next run
+        shutil.rmtree(state.LOCAL_REPO_PATH, ignore_errors=True)
+        raise
+
+
+def _head_commit(folder_path):
+    """
+    Returns the commit checked out in the folder, None if the folder is not a git checkout.
+    The git metadata is read directly, without starting git processes.
+    """
+    git_dir = os.path.join(folder_path, ".git")
+    try:
+        with open(os.path.join(git_dir, "HEAD"), encoding="utf-8") as head_file:
+            head = head_file.read().strip()
+        if not head.startswith("ref: "):
+            # Detached HEAD
+            return head or None
+        ref_name = head[len("ref: "):]
+        try:
+            with open(os.path.join(git_dir, ref_name), encoding="utf-8") as ref_file:
+                return ref_file.read().strip() or None
+        except FileNotFoundError:
+            # The ref was packed by git
+            with open(os.path.join(git_dir, "packed-refs"), encoding="utf-8") as packed_refs:
+                for line in packed_refs:
+                    fields = line.split()
+                    if len(fields) == 2 and fields[1] == ref_name:
+                        return fields[0]
+    except OSError:
+        pass
+    return None
+
+
+def _remote_head_commit():
+    """Returns the commit of the remote HEAD with a single round-trip, None if not available"""
+    try:
+        return git.cmd.Git().ls_remote(state.REPO_URL, "HEAD").split()[0]
+    except Exception as e:
+        logging.debug("Cannot read the remote HEAD: %s", e)
+        return None
+
+
+def _is_up_to_date():
+    """Checks if the local checkout is already at the remote HEAD, so there is nothing to fetch"""
+    # The index is written along with the working tree, without it the checkout is incomplete
+    if not os.path.exists(os.path.join(state.LOCAL_REPO_PATH, ".git", "index")):
+        return False
+    remote_commit = _remote_head_commit()
+    return remote_commit is not None and remote_commit == _head_commit(state.LOCAL_REPO_PATH)
+
+
 def clone_or_pull_repo():
     """Clones the repository if it doesn't exist, otherwise pulls the latest changes."""
     logging.info("Cloning or pulling repository from [%s] to [%s]...", state.REPO_URL, state.LOCAL_REPO_PATH)
@@ -16,6 +105,9 @@ def clone_or_pull_repo():
     try:
         logging.info("Starting repository update...")
 
+        if os.path.exists(f"{state.LOCAL_REPO_PATH}/.git"):
+            _ensure_sparse_checkout()
+
         if not os.path.exists(f"{state.LOCAL_REPO_PATH}/.git"):
             try:
                 # Delete all files in the local repository path
@@ -23,23 +115,28 @@ def clone_or_pull_repo():
                     logging.debug("Deleting existing files in [%s]", state.LOCAL_REPO_PATH)
                     shutil.rmtree(state.LOCAL_REPO_PATH)
                 logging.debug("Cloning repository at [%s]...", state.REPO_URL)
-                git.Repo.clone_from(state.REPO_URL, state.LOCAL_REPO_PATH)
+                _clone_repo()
             except Exception as e:
                 logging.critical("Failed to clone repository: %s", e)
                 raise
         else:
-            try:
-                logging.debug("Pulling latest changes from repository...")
-                repo = git.Repo(state.LOCAL_REPO_PATH)
-                repo.remotes.origin.pull()
-            except Exception as e:
-                if "128" in str(e):
-                    logging.warning("Repository pull failed due to authentication error, retrying clone...")
-                    shutil.rmtree(state.LOCAL_REPO_PATH)
-                    git.Repo.clone_from(state.REPO_URL, state.LOCAL_REPO_PATH)
-                else:
-                    logging.critical("Failed to pull latest changes: %s", e)
-                    raise
+            if _is_up_to_date():
+                logging.info("Repository is already up to date")
+            else:
+                try:
+                    logging.debug("Pulling latest changes from repository...")
+                    repo = git.Repo(state.LOCAL_REPO_PATH)
+                    # Keep the history shallow, the checkout is never modified locally
+                    repo.git.fetch("--depth=1", "--prune", "--no-tags", "origin")
+                    repo.git.reset("--hard", "FETCH_HEAD")
+                except Exception as e:
+                    if isinstance(e, git.GitCommandError) and e.status == 128:
+                        logging.warning("Repository pull failed due to authentication error, retrying clone...")
+                        shutil.rmtree(state.LOCAL_REPO_PATH)
+                        _clone_repo()
+                    else:
+                        logging.critical("Failed to pull latest changes: %s", e)
+                        raise
 
         logging.info("Repository update completed.")
 
@@ -47,6 +144,28 @@ def clone_or_pull_repo():
         logging.error("Failed to update source files: %s", e)
 
 
+# Every casing of the extension, so names are matched without lowering each of them
+_MARKDOWN_EXTENSIONS = (".md", ".MD", ".Md", ".mD")
+
+
+def _walk_markdown_files(folder_path):
+    """Yields the markdown files below folder_path using the file types cached by scandir"""
+    with os.scandir(folder_path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                # The git metadata holds no documents and can be large
+                if entry.name != ".git":
+                    yield from _walk_markdown_files(entry.path)
+            elif entry.name.endswith(_MARKDOWN_EXTENSIONS) and entry.is_file():
+                yield entry.path
+
+
+@functools.lru_cache(maxsize=8)
+def _cached_markdown_files(folder_path, signature):
+    """Scans the folder once per checked out commit"""
+    return tuple(_walk_markdown_files(folder_path))
+
+
 def list_files_in_folder(folder_path):
     """
     Returns a list of all markdown files in the given folder and its subdirectories.
@@ -60,11 +179,12 @@ def list_files_in_folder(folder_path):
     if not os.path.isdir(folder_path):
         raise ValueError(f"The provided path [{folder_path}] is not a directory.")
 
-    files_list = []
-    for root, _, files in os.walk(folder_path):
-        for file in files:
-            if file.lower().endswith(".md"):
-                files_list.append(os.path.join(root, file))
+    signature = _head_commit(folder_path)
+    if signature is None:
+        # Without git metadata there is no cheap way to detect changes
+        files_list = list(_walk_markdown_files(folder_path))
+    else:
+        files_list = list(_cached_markdown_files(folder_path, signature))
 
     logging.debug("Found %i markdown files in folder [%s]", len(files_list), folder_path)
     return files_list
@@ -73,17 +193,19 @@ def list_files_in_folder(folder_path):
 def pull_and_update():
     """Pulls the latest changes from the repository and updates the Gemini AI"""
 
-    while state.RELOADING_GEMINI:
-        logging.info("Gemini API is being reloaded, waiting for it to complete...")
-        time.sleep(1)
-
-    try:
-        clone_or_pull_repo()
-        state.RELOADING_GEMINI = True
-        from modules.gemini import gemini_initialize
-        gemini_initialize()
-    except Exception as e:
-        logging.critical("Failed to update the repository and reload Gemini AI: %s", e)
-    finally:
-        state.RELOADING_GEMINI = False
+    # Wait for any reload started by the bot, the checkout must not change under it
+    with state.GEMINI_RELOAD_LOCK:
+        try:
+            clone_or_pull_repo()
+            from modules.gemini import gemini_reload, gemini_sources_valid
+            sources_commit = _head_commit(state.LOCAL_REPO_PATH)
+            if sources_commit is not None and sources_commit == state.SOURCES_COMMIT and gemini_sources_valid():
+                logging.info("Sources are unchanged at commit [%s], skipping the Gemini AI reload", sources_commit)
+                return
+            gemini_reload()
+            state.SOURCES_COMMIT = sources_commit
+            from modules.batch import start_warmup
+            start_warmup()
+        except Exception as e:
+            logging.critical("Failed to update the repository and reload Gemini AI: %s", e)
 
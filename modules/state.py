@@ -1,18 +1,41 @@
 """Shared runtime state across modules."""
 
+import asyncio
+import threading
+
 # Global configuration/state values
 TELEGRAM_BOT_TOKEN = ""
 TELEGRAM_BOT_NAME = ""
 GOOGLE_API_KEY = ""
 GOOGLE_API_MODEL = ""
-GOOGLE_API_MAX_ATTEMPTS = ""
+GOOGLE_API_MAX_ATTEMPTS = 2
 REPO_URL = ""
 LOCAL_REPO_PATH = "./sources"
 MODEL = None
 BUILD_DATE = ""
-TELEGRAM_RESTART_DELAY_SECONDS = ""
+TELEGRAM_RESTART_DELAY_SECONDS = 15
+GEMINI_UPLOAD_CONCURRENCY = 8
+SYSTEM_INSTRUCTION = ""
+MENTION_PREFIXES = ()
+GEMINI_WARMUP_FILE = ""
 
 # Working variables
-RELOADING_GEMINI = False
-uploaded_files = []
+# Held by the running reload, so that a single reload runs at any given time
+GEMINI_RELOAD_LOCK = threading.RLock()
+# Set while the sources are usable, cleared during reloads
+gemini_ready = asyncio.Event()
+gemini_ready.set()
+# Loop running the bot, used to update gemini_ready from other threads
+EVENT_LOOP = None
+uploaded_files = ()
+SOURCES_FINGERPRINT = ""
+# Commit of the sources loaded on Gemini AI
+SOURCES_COMMIT = None
 GEMINI_CLIENT = None
+GEMINI_CACHE_NAME = None
+# Cloud files used by a running warmup batch job, not deleted by reloads
+BATCH_FILE_NAMES = set()
+# Pending requests, worker task and outgoing rate limiter of each chat, keyed by chat_id
+chat_queues = {}
+chat_workers = {}
+chat_limiters = {}
@@ -1,23 +1,43 @@
 
 import asyncio
 import logging
+import random
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
+from aiolimiter import AsyncLimiter
 from telegram import Update
 from telegram.error import BadRequest, Conflict, NetworkError, RetryAfter
 from telegram.ext import ContextTypes
 
 from modules import state
 from modules.exceptions import GeminiQueryException, TelegramFloodControlException
-from modules.gemini import gemini_initialize, gemini_query_sources
+from modules.gemini import gemini_initialize_async, gemini_query_sources
 from modules.helpers import (
     ZERO_WIDTH_SPACE,
-    _format_markdown_v2,
     _split_telegram_message,
+    flood_control_origins,
+    format_telegram_chunks,
+    is_flood_control,
+    is_plain_text,
     remove_markdown,
     render_latex_to_png_bytes,
     split_text_with_latex,
 )
 
+# Status code at the beginning of the Gemini error messages
+_ERROR_CODE_RE = re.compile(r"^\s*(\d{3})\b")
+
+# Per-chat workers exit after this many seconds without new requests
+_CHAT_WORKER_IDLE_SECONDS = 300
+
+# Outgoing calls are kept just below the Telegram limit of 30 messages per second
+_OUTBOUND_LIMITER = AsyncLimiter(28, 1.0)
+
+# Renders are serialized by matplotlib anyway, a dedicated thread keeps them out of the default executor
+_LATEX_RENDER_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="latex-render")
+
 
 async def handle_start(update: Update, _context: ContextTypes.DEFAULT_TYPE):
     """Handles the /start command."""
@@ -27,7 +47,7 @@ async def handle_start(update: Update, _context: ContextTypes.DEFAULT_TYPE):
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Processes user messages and replies with the PDF query result."""
-    user_message_content = str(update.message.text)
+    user_message_content = update.message.text or ""
     user_id = update.effective_user.id
     chat_id = update.message.chat_id
     logging.debug("Received message from user [%s] from chat_id: [%s]", user_id, chat_id)
@@ -35,22 +55,18 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if chat_id <= 0:
         # Message is coming from a group
         user_message_content = user_message_content.lstrip()
-        bot_name = state.TELEGRAM_BOT_NAME or ""
-        if bot_name.startswith("@"): 
-            bot_name = bot_name[1:]
-        mention_variants = {bot_name, f"@{bot_name}"} if bot_name else set()
+        # Only the head of the message can hold the mention, the rest is not lowercased
+        mention_length = len(state.MENTION_PREFIXES[0]) if state.MENTION_PREFIXES else 0
+        lowered_head = user_message_content[:mention_length].lower()
 
-        if not any(user_message_content.lower().startswith(name.lower()) for name in mention_variants):
+        if not lowered_head.startswith(state.MENTION_PREFIXES):
             # Ignore messages from groups if not directed to the bot
             logging.debug("Ignoring message from group [%s] by user [%s] as it was not directed to the bot", chat_id, user_id)
             return
         else:
             # Remove the bot name from the query
-            for name in sorted(mention_variants, key=len, reverse=True):
-                if user_message_content.lower().startswith(name.lower()):
-                    user_message_content = user_message_content[len(name) :]
-                    break
-            user_message_content = user_message_content.lstrip(" :,-")
+            mention = next(prefix for prefix in state.MENTION_PREFIXES if lowered_head.startswith(prefix))
+            user_message_content = user_message_content[len(mention) :].lstrip(" :,-")
 
     user_message_content = user_message_content.strip()
 
@@ -67,14 +83,75 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Your message is too long, please shorten it and try again.")
         return
 
+    logging.info("Processing valid message from user [%s] from chat_id [%s], content: %s", user_id, chat_id, user_message_content)
+
+    # Queue the cleaned request for the AI before any await, replies in the same chat follow the order of the messages
+    _enqueue_chat_request(chat_id, update, context, user_message_content)
+
     if len(user_message_content) > 400:
         logging.warning("Warning: Message from user [%s] from chat_id [%s] is lengthy", user_id, chat_id)
         await update.message.reply_text("Your message is lengthy, please consider shortening it for better responses.")
 
-    logging.info("Processing valid message from user [%s] from chat_id [%s], content: %s", user_id, chat_id, user_message_content)
 
-    # Send the cleaned request to the AI
-    await bot_reply_to_message(update, context, user_message_content.strip())
+def _enqueue_chat_request(chat_id: int, update: Update, context: ContextTypes.DEFAULT_TYPE, user_message_content: str):
+    """Adds the request to the chat queue, starting the chat worker if needed."""
+    queue = state.chat_queues.get(chat_id)
+    if queue is None:
+        queue = asyncio.Queue()
+        state.chat_queues[chat_id] = queue
+    queue.put_nowait((update, context, user_message_content))
+
+    if chat_id not in state.chat_workers:
+        logging.debug("Starting worker for chat_id [%s]", chat_id)
+        # Tasks of the application are awaited by PTB at shutdown
+        state.chat_workers[chat_id] = context.application.create_task(_chat_worker(chat_id, queue), update=update)
+
+
+async def _chat_worker(chat_id: int, queue: asyncio.Queue):
+    """
+    Replies to the requests of a single chat one at a time.
+    Exits once the chat has been idle for a while, releasing its queue.
+    """
+    try:
+        while True:
+            try:
+                update, context, user_message_content = await asyncio.wait_for(queue.get(), timeout=_CHAT_WORKER_IDLE_SECONDS)
+            except asyncio.TimeoutError:
+                if queue.empty():
+                    logging.debug("Stopping idle worker for chat_id [%s]", chat_id)
+                    return
+                continue
+
+            try:
+                await bot_reply_to_message(update, context, user_message_content)
+            except Exception as reply_exception:
+                # Report the error as if it was raised by the message handler
+                await context.application.process_error(update, reply_exception)
+    finally:
+        state.chat_queues.pop(chat_id, None)
+        state.chat_workers.pop(chat_id, None)
+        state.chat_limiters.pop(chat_id, None)
+
+
+async def _wait_send_slot(chat_id):
+    """Waits until a message can be sent to the chat without exceeding the Telegram rate limits."""
+    chat_limiter = state.chat_limiters.get(chat_id)
+    if chat_limiter is None:
+        # Telegram allows about one message per second in the same chat
+        chat_limiter = AsyncLimiter(1, 1.0)
+        state.chat_limiters[chat_id] = chat_limiter
+    await chat_limiter.acquire()
+    await _OUTBOUND_LIMITER.acquire()
+
+
+async def _reload_sources():
+    """Reloads the expired source files in the background, queries wait on gemini_ready meanwhile."""
+    try:
+        await gemini_initialize_async()
+    except Exception as gemini_init_exception:
+        logging.critical("Failed to reload files, error: %s", gemini_init_exception)
+    finally:
+        state.gemini_ready.set()
 
 
 async def bot_reply_to_message(update: Update, context: ContextTypes.DEFAULT_TYPE, user_message_content: str):
@@ -88,28 +165,28 @@ async def bot_reply_to_message(update: Update, context: ContextTypes.DEFAULT_TYP
     # Send a placeholder message and get the message ID
     processing_message = await update.message.reply_text("<i>Processing your request...</i>", parse_mode="html")
     logging.debug("Sent placeholder message, waiting for AI to reply.")
+    # Last status shown in the placeholder, repeated statuses are not sent again
+    status_text = None
 
-    if state.RELOADING_GEMINI:
+    if not state.gemini_ready.is_set():
         # If the Gemini API is being reloaded, wait for it to complete
         logging.info("Gemini API is being reloaded, waiting for it to complete.")
-        await bot_edit_text(context, processing_message.chat_id, processing_message.message_id, "The source files on the server are being updated, please wait...")
-        while state.RELOADING_GEMINI:
-            await asyncio.sleep(1)
+        status_text = "The source files on the server are being updated, please wait..."
+        await bot_edit_text(context, processing_message.chat_id, processing_message.message_id, status_text)
+        await state.gemini_ready.wait()
 
     # Query the Gemini API with a limited number of attempts (defined in the environment)
-    logging.debug("User [%s] with ID [%i] asked: [%s]", update.effective_user.name, user_id, user_message_content)
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        # Resolving the user name is only worth it when the message is actually logged
+        logging.debug("User [%s] with ID [%i] asked: [%s]", update.effective_user.name, user_id, user_message_content)
 
-    try:
-        max_attempts = int(state.GOOGLE_API_MAX_ATTEMPTS)
-        if max_attempts < 1:
-            max_attempts = 2
-    except (TypeError, ValueError):
-        logging.warning("Invalid GOOGLE_API_MAX_ATTEMPTS [%s], using default 2", state.GOOGLE_API_MAX_ATTEMPTS)
-        max_attempts = 2
+    max_attempts = state.GOOGLE_API_MAX_ATTEMPTS
     last_error = ""
     telegram_error_message = "Please wait..."
 
     for i in range(max_attempts):
+        # Wait for a reload started by a previous attempt or by another request
+        await state.gemini_ready.wait()
         try:
             logging.debug("Trying to request answer from Gemini AI, tentative %i out of %s", i + 1, max_attempts)
             # Request data from Gemini AI by offloading gemini_query_sources to a thread
@@ -125,12 +202,16 @@ async def bot_reply_to_message(update: Update, context: ContextTypes.DEFAULT_TYP
             error_message = str(gemini_error)
             last_error = f"Error retrieving answer from AI: {error_message}"
             logging.error("Last error: %s", last_error)
-            error_code = 0
+            # Use the status code reported by the Gemini SDK when available
+            error_code = getattr(gemini_error.__cause__, "code", None)
             try:
-                last_error = f"Error retrieving answer from AI: {error_message}"
                 logging.warning(last_error)
-                # Extract the error code from the message
-                error_code = int(str(error_message).split(" ", maxsplit=1)[0])
+                if not isinstance(error_code, int):
+                    # Extract the error code from the message
+                    code_match = _ERROR_CODE_RE.match(error_message)
+                    if code_match is None:
+                        raise ValueError(f"No error code in [{error_message}]")
+                    error_code = int(code_match.group(1))
                 logging.warning("Gemini APIs returned error code: [%i]", error_code)
                 # Handle the error code
                 if 500 <= error_code < 600:
@@ -142,14 +223,10 @@ async def bot_reply_to_message(update: Update, context: ContextTypes.DEFAULT_TYP
                     if error_code == 403:
                         # If permission denied, files are expired, reload them
                         logging.warning("Files might be expired, need to reload them")
-                        try:
-                            state.RELOADING_GEMINI = True
-                            gemini_initialize()
-                        except Exception as gemini_init_exception:
-                            logging.critical("Failed to reload files, error: %s", gemini_init_exception)
-                            last_error = f"Error reloading files: {str(gemini_init_exception)}"
-                        finally:
-                            state.RELOADING_GEMINI = False
+                        if state.gemini_ready.is_set():
+                            # Cleared right away, so the other requests wait instead of reloading again
+                            state.gemini_ready.clear()
+                            context.application.create_task(_reload_sources())
                 else:
                     # Something bad happeneded and needs to be fixed
                     telegram_error_message = "Unexpected server error, please trying again later."
@@ -162,12 +239,16 @@ async def bot_reply_to_message(update: Update, context: ContextTypes.DEFAULT_TYP
                 telegram_error_message = "Unexpected server error, trying again, please be patient"
         except Exception as generic_exception:
             telegram_error_message = "Unexpected server error, trying again, please be patient"
-            last_error = f"Unexpected error occurred while querying Gemini API: {str(generic_exception)}"
+            last_error = f"Unexpected error occurred while querying Gemini API: {generic_exception}"
             logging.error(last_error)
 
-        logging.warning("Waiting 3 seconds before next attempt, sending answer to client")
-        await bot_edit_text(context, processing_message.chat_id, processing_message.message_id, telegram_error_message)
-        await asyncio.sleep(3)
+        # Exponential backoff with jitter, so concurrent requests do not retry in lockstep
+        retry_delay = min(2 ** i, 30) + random.uniform(0, 1)
+        logging.warning("Waiting %.1f seconds before next attempt, sending answer to client", retry_delay)
+        if telegram_error_message != status_text:
+            status_text = telegram_error_message
+            await bot_edit_text(context, processing_message.chat_id, processing_message.message_id, status_text)
+        await asyncio.sleep(retry_delay)
 
     logging.error("Error while creating an answer for user [%s]: %s", user_id, last_error)
     # Replace the placeholder message with an error message
@@ -175,68 +256,121 @@ async def bot_reply_to_message(update: Update, context: ContextTypes.DEFAULT_TYP
     logging.debug("Updated message with error notification.")
 
 
+def _resolve_render(latex_render: asyncio.Future, latex_bytes) -> None:
+    """Publishes a rendered formula, unless the reply was abandoned meanwhile."""
+    if not latex_render.done():
+        latex_render.set_result(latex_bytes)
+
+
+def _render_formulas(formulas, latex_renders, loop, stop_renders: threading.Event) -> None:
+    """
+    Renders the formulas of a reply in order from a single worker thread,
+    passing each image to the event loop as soon as it is ready.
+    """
+    for latex, latex_render in zip(formulas, latex_renders):
+        if stop_renders.is_set():
+            return
+        try:
+            latex_bytes = render_latex_to_png_bytes(latex)
+        except Exception as render_exception:
+            logging.warning("Failed to render LaTeX formula: %s", render_exception)
+            latex_bytes = None
+        try:
+            loop.call_soon_threadsafe(_resolve_render, latex_render, latex_bytes)
+        except RuntimeError:
+            # The event loop was closed, nobody is waiting for the images
+            return
+
+
+async def _send_reply_op(context, chat_id, message_id, reply_op, parse_mode="MarkdownV2"):
+    """
+    Executes a single step of a reply built by bot_edit_text.
+    A formula step sends nothing, it returns the steps replacing it once the render is done.
+    """
+    op_type, op_content = reply_op
+    if op_type == "latex":
+        latex_render, latex = op_content
+        latex_bytes = await latex_render
+        if latex_bytes:
+            return [("photo", latex_bytes)]
+        # Send the formula as text if it cannot be rendered
+        return [("send", chunk) for chunk in format_telegram_chunks(f"${latex}$")]
+
+    await _wait_send_slot(chat_id)
+    if op_type == "photo":
+        await context.bot.send_photo(chat_id=chat_id, photo=op_content)
+    elif op_type == "edit":
+        await context.bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=op_content, parse_mode=parse_mode)
+    else:
+        await context.bot.send_message(chat_id=chat_id, text=op_content, parse_mode=parse_mode)
+
+
 async def bot_edit_text(context, chat_id, message_id, text: str):
     """
     Edits the message with the content of the file.
     """
+    # Steps of the reply, the first one edits the placeholder and the others follow as new messages
+    reply_ops = []
+    formulas = []
+    latex_renders = []
+    stop_renders = threading.Event()
+    render_job = None
+    next_op = 0
+    parse_mode = "MarkdownV2"
+
+    async def _run_ops():
+        """Sends the steps of the reply in order, from the first one not sent yet"""
+        nonlocal next_op
+        while next_op < len(reply_ops):
+            resolved_ops = await _send_reply_op(context, chat_id, message_id, reply_ops[next_op], parse_mode)
+            if resolved_ops is None:
+                next_op += 1
+            else:
+                reply_ops[next_op:next_op + 1] = resolved_ops
+
     try:
         logging.debug("Sending edited message")
-        segments = split_text_with_latex(text)
-        has_latex = any(segment_type == "latex" for segment_type, _ in segments)
-
-        if not has_latex:
-            escaped_text = _format_markdown_v2(text).strip()
-            chunks = _split_telegram_message(escaped_text)
-            await context.bot.edit_message_text(
-                chat_id=chat_id,
-                message_id=message_id,
-                text=chunks[0],
-                parse_mode="MarkdownV2",
-            )
-            for chunk in chunks[1:]:
-                await context.bot.send_message(chat_id=chat_id, text=chunk, parse_mode="MarkdownV2")
-            return
-
-        first_sent = False
-        for segment_type, segment_content in segments:
-            if segment_type == "text":
-                if not segment_content.strip():
-                    continue
-                escaped_text = _format_markdown_v2(segment_content).strip()
-                if not escaped_text:
-                    continue
-                chunks = _split_telegram_message(escaped_text)
-                if not first_sent:
-                    await context.bot.edit_message_text(
-                        chat_id=chat_id,
-                        message_id=message_id,
-                        text=chunks[0],
-                        parse_mode="MarkdownV2",
-                    )
-                    for chunk in chunks[1:]:
-                        await context.bot.send_message(chat_id=chat_id, text=chunk, parse_mode="MarkdownV2")
-                    first_sent = True
+        if not text or text.isspace():
+            # Nothing to format, and Telegram rejects empty messages
+            reply_ops.append(("edit", ZERO_WIDTH_SPACE))
+        else:
+            segments = split_text_with_latex(text)
+            has_latex = any(segment_type == "latex" for segment_type, _ in segments)
+
+            if not has_latex:
+                if is_plain_text(text):
+                    # Nothing to format or escape, send the text as it is
+                    parse_mode = None
+                    chunks = _split_telegram_message(text.strip())
                 else:
-                    for chunk in chunks:
-                        await context.bot.send_message(chat_id=chat_id, text=chunk, parse_mode="MarkdownV2")
-                continue
-
-            latex_bytes = render_latex_to_png_bytes(segment_content)
-            if not first_sent:
-                await context.bot.edit_message_text(
-                    chat_id=chat_id,
-                    message_id=message_id,
-                    text=ZERO_WIDTH_SPACE,
-                    parse_mode="MarkdownV2",
-                )
-                first_sent = True
-
-            if latex_bytes:
-                await context.bot.send_photo(chat_id=chat_id, photo=latex_bytes)
+                    chunks = format_telegram_chunks(text)
+                reply_ops.append(("edit", chunks[0]))
+                reply_ops.extend(("send", chunk) for chunk in chunks[1:])
             else:
-                fallback_text = _format_markdown_v2(f"${segment_content}$").strip()
-                for chunk in _split_telegram_message(fallback_text):
-                    await context.bot.send_message(chat_id=chat_id, text=chunk, parse_mode="MarkdownV2")
+                for segment_type, segment_content in segments:
+                    if segment_type == "text":
+                        if not segment_content.strip():
+                            continue
+                        chunks = format_telegram_chunks(segment_content)
+                        if chunks == ("",):
+                            continue
+                        for chunk in chunks:
+                            reply_ops.append(("send" if reply_ops else "edit", chunk))
+                        continue
+
+                    if not reply_ops:
+                        reply_ops.append(("edit", ZERO_WIDTH_SPACE))
+                    latex_render = asyncio.get_running_loop().create_future()
+                    formulas.append(segment_content)
+                    latex_renders.append(latex_render)
+                    reply_ops.append(("latex", (latex_render, segment_content)))
+
+                # Rendering is CPU bound, keep it off the event loop, started up front
+                # so the renders overlap with the sends, which must stay in order
+                loop = asyncio.get_running_loop()
+                render_job = loop.run_in_executor(_LATEX_RENDER_EXECUTOR, _render_formulas, formulas, latex_renders, loop, stop_renders)
+
+        await _run_ops()
     except RetryAfter as retry_exception:
         # Handle flood control specifically
         retry_seconds = retry_exception.retry_after
@@ -244,19 +378,16 @@ async def bot_edit_text(context, chat_id, message_id, text: str):
         
         # Check if this is the specific flood control error from the Network Retry Loop
         error_message = str(retry_exception)
-        if "Flood control exceeded" in error_message and "Network Retry Loop" in error_message:
+        if "Network Retry Loop" in flood_control_origins(error_message):
             logging.critical("Network Retry Loop flood control detected: %s", error_message)
             raise TelegramFloodControlException(
                 f"Flood control exceeded in Network Retry Loop: {error_message}"
             ) from retry_exception
         
-        # For regular flood control, wait and retry
+        # For regular flood control, wait and resume from the step that was rejected
         await asyncio.sleep(retry_seconds + 1)  # Add 1 second buffer
         try:
-            chunks = _split_telegram_message(escaped_text)
-            await context.bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=chunks[0], parse_mode="MarkdownV2")
-            for chunk in chunks[1:]:
-                await context.bot.send_message(chat_id=chat_id, text=chunk, parse_mode="MarkdownV2")
+            await _run_ops()
         except Exception as retry_edit_exception:
             logging.error("Failed to edit message after flood control retry: %s", retry_edit_exception)
             raise
@@ -269,7 +400,7 @@ async def bot_edit_text(context, chat_id, message_id, text: str):
     except NetworkError as network_exception:
         # Check for flood control in network errors
         error_message = str(network_exception)
-        if "Flood control exceeded" in error_message:
+        if is_flood_control(error_message):
             logging.critical("Network-level flood control detected: %s", error_message)
             raise TelegramFloodControlException(
                 f"Network flood control exceeded: {error_message}"
@@ -279,7 +410,7 @@ async def bot_edit_text(context, chat_id, message_id, text: str):
     except Exception as ret_exception:
         # Check for flood control in generic exceptions
         error_message = str(ret_exception)
-        if "Flood control exceeded" in error_message and ("Network Retry Loop" in error_message or "Polling Updates" in error_message):
+        if flood_control_origins(error_message):
             logging.critical("Flood control detected in polling/network retry loop: %s", error_message)
             raise TelegramFloodControlException(
                 f"Flood control in polling loop: {error_message}"
@@ -290,18 +421,28 @@ async def bot_edit_text(context, chat_id, message_id, text: str):
             # Fallback to plain text if MarkdownV2 fails
             logging.debug("Trying to edit message with plain text")
             text = remove_markdown(text).strip()
+            await _wait_send_slot(chat_id)
             await context.bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text)
         except Exception as edit_exception:
             logging.error("Failed to edit message with fallback: %s", edit_exception)
             try:
+                await _wait_send_slot(chat_id)
                 await context.bot.send_message(chat_id, "An error occurred, please try again later")
             except Exception as send_exception:
                 logging.error("Failed to send error message: %s", send_exception)
+    finally:
+        # Renders are not needed anymore if a send failed
+        stop_renders.set()
+        if render_job is not None:
+            render_job.cancel()
+        for latex_render in latex_renders:
+            latex_render.cancel()
 
 
 async def bot_send_message(context, chat_id, message):
     """Send a message to the user"""
     try:
+        await _wait_send_slot(chat_id)
         await context.bot.send_message(chat_id, message)
     except RetryAfter as retry_exception:
         # Handle flood control specifically
@@ -310,7 +451,7 @@ async def bot_send_message(context, chat_id, message):
         
         # Check if this is the specific flood control error from the Network Retry Loop
         error_message = str(retry_exception)
-        if "Flood control exceeded" in error_message and "Network Retry Loop" in error_message:
+        if "Network Retry Loop" in flood_control_origins(error_message):
             logging.critical("Network Retry Loop flood control detected in send_message: %s", error_message)
             raise TelegramFloodControlException(
                 f"Flood control exceeded in Network Retry Loop: {error_message}"
@@ -319,6 +460,7 @@ async def bot_send_message(context, chat_id, message):
         # For regular flood control, wait and retry
         await asyncio.sleep(retry_seconds + 1)  # Add 1 second buffer
         try:
+            await _wait_send_slot(chat_id)
             await context.bot.send_message(chat_id, message)
         except Exception as retry_send_exception:
             logging.error("Failed to send message after flood control retry: %s", retry_send_exception)
@@ -326,7 +468,7 @@ async def bot_send_message(context, chat_id, message):
     except NetworkError as network_exception:
         # Check for flood control in network errors
         error_message = str(network_exception)
-        if "Flood control exceeded" in error_message:
+        if is_flood_control(error_message):
             logging.critical("Network-level flood control detected in send_message: %s", error_message)
             raise TelegramFloodControlException(
                 f"Network flood control exceeded: {error_message}"
@@ -336,7 +478,7 @@ async def bot_send_message(context, chat_id, message):
     except Exception as send_exception:
         # Check for flood control in generic exceptions
         error_message = str(send_exception)
-        if "Flood control exceeded" in error_message and ("Network Retry Loop" in error_message or "Polling Updates" in error_message):
+        if flood_control_origins(error_message):
             logging.critical("Flood control detected in send_message polling/network retry loop: %s", error_message)
             raise TelegramFloodControlException(
                 f"Flood control in polling loop: {error_message}"